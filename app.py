@@ -1,11 +1,21 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash
+from flask import Flask, render_template, request, redirect, url_for, session, flash, Response, stream_with_context
 from flask_socketio import join_room,leave_room,send,SocketIO,emit
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
-from collections import defaultdict
+from collections import defaultdict, namedtuple, OrderedDict
 from datetime import datetime
 import os
+import csv
+import gzip
+import io
+import json
+import zlib
+import time
+import threading
+import click
+from contextlib import contextmanager
+from functools import wraps
 from dotenv import load_dotenv
 from datetime import datetime, timezone,timedelta
 
@@ -31,6 +41,18 @@ db = SQLAlchemy(app)
 UPLOAD_FOLDER = os.path.join(os.getcwd(), 'static/images')
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
+# Chat messages older than this many days are moved to the archive table.
+app.config['CHAT_RETENTION_DAYS'] = int(os.getenv('CHAT_RETENTION_DAYS', 90))
+
+# Rate limiting: 'memory' keeps buckets per process, a redis:// URL shares them
+# between workers. MAX_INFLIGHT_WRITES should stay below the DB pool size.
+app.config['RATE_LIMIT_STORAGE'] = os.getenv('RATE_LIMIT_STORAGE', 'memory')
+app.config['MAX_INFLIGHT_WRITES'] = int(os.getenv('MAX_INFLIGHT_WRITES', 10))
+
+# Seconds a cached room lookup is trusted. Caches are per process,
+# so this bounds how stale another worker's view can get.
+app.config['ROOM_CACHE_TTL'] = int(os.getenv('ROOM_CACHE_TTL', 300))
+
 
 #database models
 
@@ -105,6 +127,20 @@ class Timers(db.Model):
     start_time = db.Column(db.DateTime, nullable=False)
     end_time = db.Column(db.DateTime, default=None, nullable=True)
     duration = db.Column(db.Integer, nullable=False)
+    # Period buckets derived from start_time, filled in when the timer is closed.
+    day_bucket = db.Column(db.String(10), nullable=True)    # 'YYYY-MM-DD'
+    week_bucket = db.Column(db.String(8), nullable=True)    # ISO week, 'YYYY-Www'
+    month_bucket = db.Column(db.String(7), nullable=True)   # 'YYYY-MM'
+
+    # Covering indexes so leaderboard and analytics sums never touch the table rows.
+    __table_args__ = (
+        db.Index('ix_timers_room_day', 'room_id', 'day_bucket', 'user_id', 'duration'),
+        db.Index('ix_timers_room_week', 'room_id', 'week_bucket', 'user_id', 'duration'),
+        db.Index('ix_timers_room_month', 'room_id', 'month_bucket', 'user_id', 'duration'),
+        db.Index('ix_timers_user_day', 'user_id', 'day_bucket', 'duration'),
+        db.Index('ix_timers_user_week', 'user_id', 'week_bucket', 'duration'),
+        db.Index('ix_timers_user_room', 'user_id', 'room_id', 'day_bucket', 'duration'),
+    )
 
 class ChatMessage(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -114,17 +150,343 @@ class ChatMessage(db.Model):
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
 
+    # Serves newest-first chat pages as an index range scan.
+    __table_args__ = (
+        db.Index('ix_chat_message_room_time', 'room_id', 'timestamp', 'id'),
+    )
+
+# Cold tier for chat: messages moved out of ChatMessage by `flask compact-history`.
+# The hot table may hand out an archived id again (SQLite, MySQL < 8.0 after a
+# restart), so the archive has its own key and keeps the original id alongside.
+# The sender's name comes from the User join.
+class ArchivedChatMessage(db.Model):
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    message_id = db.Column(db.Integer, nullable=False)  # ChatMessage.id before archiving
+    room_id = db.Column(db.Integer, db.ForeignKey('studyrooms.room_id', ondelete='CASCADE'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    message = db.Column(db.Text, nullable=False)
+    timestamp = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_archived_chat_message_room_time', 'room_id', 'timestamp', 'message_id'),
+    )
 
+# Cold tier for timers: completed sessions rolled up per (user, room, day).
+class TimerSummary(db.Model):
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    room_id = db.Column(db.Integer, db.ForeignKey('studyrooms.room_id', ondelete='CASCADE'), nullable=False)
+    day_bucket = db.Column(db.String(10), nullable=False)
+    week_bucket = db.Column(db.String(8), nullable=False)
+    month_bucket = db.Column(db.String(7), nullable=False)
+    duration = db.Column(db.Integer, nullable=False, default=0)       # summed seconds
+    session_count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'room_id', 'day_bucket', name='uq_timer_summary_user_room_day'),
+        db.Index('ix_timer_summary_room_user', 'room_id', 'user_id', 'duration'),
+        db.Index('ix_timer_summary_user_room', 'user_id', 'room_id', 'duration'),
+        db.Index('ix_timer_summary_user_day', 'user_id', 'day_bucket', 'duration'),
+        db.Index('ix_timer_summary_user_week', 'user_id', 'week_bucket', 'duration'),
+    )
 
     
-# Create tables
+def migrate_timer_buckets():
+    # db.create_all() never alters an existing table, so older databases get the
+    # bucket columns and their indexes added here. Rows are filled separately by
+    # `flask backfill-timer-buckets`.
+    existing = {column['name'] for column in db.inspect(db.engine).get_columns(Timers.__tablename__)}
+    with db.engine.begin() as conn:
+        for column in (Timers.day_bucket, Timers.week_bucket, Timers.month_bucket):
+            if column.name not in existing:
+                conn.execute(db.text(
+                    f"ALTER TABLE {Timers.__tablename__} "
+                    f"ADD COLUMN {column.name} {column.type.compile(db.engine.dialect)} NULL"
+                ))
+        for index in Timers.__table__.indexes:
+            index.create(conn, checkfirst=True)
+
+def migrate_chat_indexes():
+    # Chat pages read ChatMessage newest first by room; older tables lack the index.
+    with db.engine.begin() as conn:
+        for index in ChatMessage.__table__.indexes:
+            index.create(conn, checkfirst=True)
+
+# Create tables, then bring existing ones up to the current schema before any
+# request can query the new columns.
 with app.app_context():
     db.create_all()
+    migrate_timer_buckets()
+    migrate_chat_indexes()
 
 active_timers = {}  # { room_id: { user_id: start_time } }
 paused_timers = {}  # { room_id: { user_id: paused_elapsed } }
 
 
+def timer_buckets(start_time):
+    # Day, ISO week (Monday start) and month keys for a timer's start_time.
+    iso_year, iso_week, _ = start_time.isocalendar()
+    return (
+        start_time.strftime('%Y-%m-%d'),
+        f"{iso_year}-W{iso_week:02d}",
+        start_time.strftime('%Y-%m'),
+    )
+
+def close_timer(timer):
+    timer.end_time = datetime.utcnow()
+    timer.duration = (timer.end_time - timer.start_time).seconds
+    timer.day_bucket, timer.week_bucket, timer.month_bucket = timer_buckets(timer.start_time)
+
+def timer_compaction_cutoff(now):
+    # Start of the earliest leaderboard window (this month or this ISO week,
+    # whichever began first). Older timers only feed the overall totals.
+    start_of_day = datetime(now.year, now.month, now.day)
+    return min(datetime(now.year, now.month, 1), start_of_day - timedelta(days=now.weekday()))
+
+def merge_totals(*results):
+    # Adds up (key, total) rows coming from the hot and cold tiers.
+    totals = defaultdict(int)
+    for rows in results:
+        for key, total in rows:
+            totals[key] += int(total)
+    return sorted(totals.items())
+
+CHAT_PAGE_SIZE = 50
+
+def room_chat_history(room_id, before=None, limit=CHAT_PAGE_SIZE):
+    # The newest `limit` messages of a room across ChatMessage and
+    # ArchivedChatMessage, returned oldest first and ordered by (timestamp,
+    # original message id). `before` is an optional (timestamp, id) cursor.
+    # Each tier is sorted and limited on its own (room_id, timestamp, id) index
+    # before the union, so only 2 * limit rows are merged.
+    tiers = []
+    for model, message_id in ((ChatMessage, ChatMessage.id), (ArchivedChatMessage, ArchivedChatMessage.message_id)):
+        stmt = (
+            db.select(message_id.label('id'), model.message, model.timestamp, User.name, User.profile_picture)
+            .join(User, User.id == model.user_id)
+            .where(model.room_id == room_id)
+        )
+        if before is not None:
+            before_time, before_id = before
+            if before_id is None:
+                stmt = stmt.where(model.timestamp < before_time)
+            else:
+                stmt = stmt.where(db.or_(
+                    model.timestamp < before_time,
+                    db.and_(model.timestamp == before_time, message_id < before_id)
+                ))
+        stmt = stmt.order_by(model.timestamp.desc(), message_id.desc()).limit(limit)
+        tiers.append(db.select(stmt.subquery()))
+    history = db.union_all(*tiers).subquery()
+
+    page = db.session.execute(
+        db.select(history).order_by(history.c.timestamp.desc(), history.c.id.desc()).limit(limit)
+    ).all()
+    return page[::-1]
+
+
+# ---------------------------
+# Room lookup cache
+# ---------------------------
+# Plain snapshot of a Studyrooms row, safe to share between requests.
+RoomInfo = namedtuple('RoomInfo', 'room_id room_name room_code owner_id')
+
+class LookupCache:
+    """Small in-process LRU cache whose entries expire after a TTL."""
+
+    def __init__(self, ttl, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()  # { key: (value, expires_at) }
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+room_cache = LookupCache(app.config['ROOM_CACHE_TTL'])  # { room_code: RoomInfo }
+
+def cache_room(room):
+    info = RoomInfo(room.room_id, room.room_name, room.room_code, room.owner_id)
+    room_cache.set(room.room_code, info)
+    return info
+
+def get_room(room_code):
+    # Only rooms that exist are cached, so a new room is never hidden by a miss.
+    room = room_cache.get(room_code)
+    if room is None:
+        row = Studyrooms.query.filter_by(room_code=room_code).first()
+        if row is None:
+            return None
+        room = cache_room(row)
+    return room
+
+# ---------------------------
+# Rate limiting and admission control
+# ---------------------------
+# (tokens per second, burst size) for each write action, per user and per room.
+RATE_LIMITS = {
+    'message': {'user': (1, 5), 'room': (10, 30)},
+    'timer': {'user': (0.5, 5), 'room': (5, 20)},
+    'blog_post': {'user': (0.05, 3), 'room': (0.5, 10)},
+}
+
+class MemoryRateLimiter:
+    """Token buckets held in this process."""
+
+    MAX_BUCKETS = 10000
+
+    def __init__(self):
+        self._buckets = {}  # { key: (tokens, last_refill) }
+        self._lock = threading.Lock()
+
+    def take(self, buckets):
+        # buckets is a list of (key, rate, burst). Takes a token from every bucket
+        # or from none; returns the index of the first empty bucket, else None.
+        now = time.monotonic()
+        with self._lock:
+            refilled = []
+            for key, rate, burst in buckets:
+                tokens, last = self._buckets.get(key, (burst, now))
+                refilled.append(min(burst, tokens + (now - last) * rate))
+            empty = next((i for i, tokens in enumerate(refilled) if tokens < 1), None)
+            for (key, _, _), tokens in zip(buckets, refilled):
+                self._buckets[key] = (tokens - 1 if empty is None else tokens, now)
+            if len(self._buckets) > self.MAX_BUCKETS:
+                self._prune(now)
+            return empty
+
+    def _prune(self, now):
+        # Buckets idle for a minute have refilled for every limit in RATE_LIMITS.
+        for key, (_, last) in list(self._buckets.items()):
+            if now - last > 60:
+                del self._buckets[key]
+
+class RedisRateLimiter:
+    """Token buckets held in Redis, shared by every worker using the same URL."""
+
+    # Same all-or-nothing take as MemoryRateLimiter, done atomically in Redis.
+    # ARGV is now followed by a (rate, burst) pair per key; returns the 1-based
+    # index of the first empty bucket, or 0 when every bucket gave a token.
+    SCRIPT = """
+    local now = tonumber(ARGV[1])
+    local refilled = {}
+    local empty = 0
+    for i, key in ipairs(KEYS) do
+        local rate, burst = tonumber(ARGV[i * 2]), tonumber(ARGV[i * 2 + 1])
+        local bucket = redis.call('HMGET', key, 'tokens', 'last')
+        local tokens = tonumber(bucket[1]) or burst
+        local last = tonumber(bucket[2]) or now
+        refilled[i] = math.min(burst, tokens + (now - last) * rate)
+        if empty == 0 and refilled[i] < 1 then
+            empty = i
+        end
+    end
+    for i, key in ipairs(KEYS) do
+        local rate, burst = tonumber(ARGV[i * 2]), tonumber(ARGV[i * 2 + 1])
+        local tokens = refilled[i]
+        if empty == 0 then
+            tokens = tokens - 1
+        end
+        redis.call('HSET', key, 'tokens', tokens, 'last', now)
+        redis.call('EXPIRE', key, math.ceil(burst / rate) + 1)
+    end
+    return empty
+    """
+
+    def __init__(self, url):
+        import redis  # only needed when RATE_LIMIT_STORAGE points at Redis
+        self._redis = redis.Redis.from_url(url)
+        self._script = self._redis.register_script(self.SCRIPT)
+        self._errors = redis.RedisError
+
+    def take(self, buckets):
+        args = [time.time()]
+        for _, rate, burst in buckets:
+            args.extend([rate, burst])
+        try:
+            empty = self._script(keys=[f"ratelimit:{key}" for key, _, _ in buckets], args=args)
+        except self._errors as e:
+            # Fail open: an unavailable limiter store should not take chat down.
+            print(f"Rate limiter unavailable: {e}")
+            return None
+        return int(empty) - 1 if empty else None
+
+def make_rate_limiter(storage):
+    if storage == 'memory':
+        return MemoryRateLimiter()
+    if storage.split('://', 1)[0] in ('redis', 'rediss', 'unix'):
+        return RedisRateLimiter(storage)
+    raise ValueError(
+        f"RATE_LIMIT_STORAGE must be 'memory' or a redis://, rediss:// or unix:// URL, got {storage!r}"
+    )
+
+rate_limiter = make_rate_limiter(app.config['RATE_LIMIT_STORAGE'])
+# Writes that may hold a DB connection at once; extra work is rejected, not queued.
+write_slots = threading.BoundedSemaphore(app.config['MAX_INFLIGHT_WRITES'])
+rate_limit_rejections = defaultdict(int)  # { 'action:reason': count }
+rate_limit_lock = threading.Lock()
+
+@contextmanager
+def admission(action, user_id, room_id):
+    # Yields None when the write may go ahead, otherwise why it was rejected:
+    # 'overload' when no write slot is free, 'user' or 'room' for an empty
+    # bucket. Tokens are only spent by writes that are admitted.
+    if not write_slots.acquire(blocking=False):
+        rejected = 'overload'
+    else:
+        limits = RATE_LIMITS[action]
+        empty = rate_limiter.take([
+            (f"user:{user_id}:{action}", *limits['user']),
+            (f"room:{room_id}:{action}", *limits['room']),
+        ])
+        if empty is None:
+            try:
+                yield None
+            finally:
+                write_slots.release()
+            return
+        write_slots.release()
+        rejected = ('user', 'room')[empty]
+
+    with rate_limit_lock:
+        rate_limit_rejections[f"{action}:{rejected}"] += 1
+    yield rejected
+
+def rate_limited(action):
+    # Socket.IO handler decorator; rejected events get a 'rate_limited' reply.
+    def decorator(handler):
+        @wraps(handler)
+        def wrapper(data):
+            room_id = data.get('room_id', data.get('room'))
+            with admission(action, session.get('user_id'), room_id) as rejected:
+                if rejected:
+                    emit('rate_limited', {'action': action, 'event': request.event['message'], 'reason': rejected})
+                    return
+                return handler(data)
+        return wrapper
+    return decorator
+
+
 # Routes
 @app.route('/')
 def index():
@@ -215,7 +577,7 @@ def createstudyroom():
             return render_template('createstudyroom.html')
 
         # Check if room_code already exists
-        existing_room = Studyrooms.query.filter_by(room_code=room_code).first()
+        existing_room = get_room(room_code)
         if existing_room:
             flash("Unique Code already exists. Try another one.", "error")
             return render_template('createstudyroom.html')
@@ -235,6 +597,7 @@ def createstudyroom():
         new_member = Roommembers(room_id=new_room.room_id, user_id=owner_id)
         db.session.add(new_member)
         db.session.commit()
+        cache_room(new_room)
 
         flash("Study Room created successfully!", "success")
         return redirect(url_for('dashboard'))  # Redirect to dashboard instead of studyroom page
@@ -250,19 +613,46 @@ def studyroom(room_code):
         return redirect(url_for("homepage"))
 
     # Fetch room details from the database
-    room = Studyrooms.query.filter_by(room_code=room_code).first()
+    room = get_room(room_code)
     
     if not room:
         flash("Study Room not found!", "danger")
         return redirect(url_for('dashboard'))  # Redirect if room does not exist
 
-    # Fetch chat history with sender's name and profile picture
-    messages = ChatMessage.query.join(User).add_columns(
-        ChatMessage.message, ChatMessage.timestamp, User.name, User.profile_picture
-    ).filter(ChatMessage.room_id == room.room_id).order_by(ChatMessage.timestamp).all()
+    # Fetch the newest page of chat history with sender's name and profile picture;
+    # the page loads older messages from studyroom_messages on demand.
+    messages = room_chat_history(room.room_id)
     
     # Render studyroom.html with room details and messages
-    return render_template('studyroom.html', room=room, messages=messages)
+    return render_template('studyroom.html', room=room, messages=messages, chat_page_size=CHAT_PAGE_SIZE)
+
+@app.route('/studyroom/<room_code>/messages')
+def studyroom_messages(room_code):
+    if 'user_id' not in session:
+        return {"error": "Not signed in"}, 401
+
+    room = get_room(room_code)
+    if not room:
+        return {"error": "Room not found"}, 404
+
+    # Page backwards through history using the oldest message already seen:
+    # ?before=<its timestamp>&before_id=<its id>&limit=50
+    before = None
+    if request.args.get('before'):
+        try:
+            before_time = datetime.fromisoformat(request.args['before'])
+        except ValueError:
+            return {"error": "before must be an ISO timestamp"}, 400
+        before = (before_time, request.args.get('before_id', type=int))
+    limit = max(1, min(request.args.get('limit', CHAT_PAGE_SIZE, type=int), 200))
+    messages = room_chat_history(room.room_id, before=before, limit=limit)
+    return {"messages": [{
+        "id": msg.id,
+        "username": msg.name,
+        "message": msg.message,
+        "timestamp": msg.timestamp.isoformat() if msg.timestamp else None,
+        "profile_picture": msg.profile_picture
+    } for msg in messages]}
 
 
 
@@ -280,41 +670,48 @@ def analysis_data():
         return redirect(url_for('signin'))
     
     user_id = session['user_id']
-    # Get completed timer sessions (where end_time is set)
-    timers = Timers.query.filter_by(user_id=user_id).filter(Timers.end_time.isnot(None)).all()
-
-    # Aggregations
-    daily = defaultdict(int)
-    weekly = defaultdict(int)
-    session_durations = []
-    room_comparison = defaultdict(int)
-
-    for timer in timers:
-        # Daily: group by date of start_time (YYYY-MM-DD)
-        day = timer.start_time.strftime('%Y-%m-%d')
-        daily[day] += timer.duration
-        
-        # Weekly: group by year and week number (e.g. '2025-W07')
-        week = timer.start_time.strftime('%Y-W%U')
-        weekly[week] += timer.duration
-        
-        # Record each session duration for distribution analysis
-        session_durations.append(timer.duration)
-        
-        # Room comparison: sum durations per room_id
-        room_comparison[timer.room_id] += timer.duration
+    # Completed timer sessions carry their period buckets, so the grouping
+    # happens in the database against the (user_id, bucket) indexes. Each
+    # total adds the hot Timers rows to the compacted TimerSummary rows.
+    # completed_column is the bucket whose presence marks a closed timer; it is
+    # part of the index serving each grouping, so every sum stays index-only.
+    def totals_by(timer_column, summary_column, completed_column):
+        hot = (
+            db.session.query(timer_column, db.func.sum(Timers.duration))
+            .filter(Timers.user_id == user_id, completed_column.isnot(None))
+            .group_by(timer_column)
+            .all()
+        )
+        cold = (
+            db.session.query(summary_column, db.func.sum(TimerSummary.duration))
+            .filter(TimerSummary.user_id == user_id)
+            .group_by(summary_column)
+            .all()
+        )
+        return merge_totals(hot, cold)
+
+    daily = totals_by(Timers.day_bucket, TimerSummary.day_bucket, Timers.day_bucket)
+    weekly = totals_by(Timers.week_bucket, TimerSummary.week_bucket, Timers.week_bucket)
+    room_comparison = totals_by(Timers.room_id, TimerSummary.room_id, Timers.day_bucket)
+
+    # Record each session duration for distribution analysis. Compacted
+    # sessions only survive as daily sums, so this covers the hot tier.
+    session_durations = [
+        duration for (duration,) in
+        db.session.query(Timers.duration).filter(Timers.user_id == user_id, Timers.day_bucket.isnot(None))
+    ]
 
     # Prepare room data with room names
     room_data = []
-    for room_id, total in room_comparison.items():
+    for room_id, total in room_comparison:
         room_obj = Studyrooms.query.get(room_id)
         room_name = room_obj.room_name if room_obj else f'Room {room_id}'
         room_data.append({'room': room_name, 'total': total})
 
     # Return the aggregated data as JSON
     return {
-        'daily': sorted(daily.items()),
-        'weekly': sorted(weekly.items()),
+        'daily': daily,
+        'weekly': weekly,
         'session_durations': session_durations,
         'room_comparison': room_data
     }
@@ -330,6 +727,7 @@ def handle_join(data):
    # send(f"{username} has joined the chat.", to=room)
 
 @socketio.on('message')
+@rate_limited('message')
 def handle_message(data):
     room = data['room']
     username = data['username']
@@ -360,7 +758,7 @@ def joinstudyroom():
         room_code = request.form.get('room_code')
 
         # Check if study room exists
-        study_room = Studyrooms.query.filter_by(room_code=room_code).first()
+        study_room = get_room(room_code)
 
         if not study_room:
             flash("No study room found with that code!", "error")
@@ -371,7 +769,8 @@ def joinstudyroom():
             flash("You need to be logged in to join a study room.", "error")
             return redirect(url_for('signin'))
 
-        # Check if user is already a member of the study room
+        # Check if user is already a member of the study room. This reads the DB, not a
+        # per-process cache, so a user who left via another worker can rejoin at once.
         existing_member = Roommembers.query.filter_by(room_id=study_room.room_id, user_id=user_id).first()
         if existing_member:
             flash("You are already a member of this study room!", "info")
@@ -479,6 +878,7 @@ def handle_join_room(data):
     emit('update_studying_members', {'members': studying_members}, room=room_id)
 
 @socketio.on('start_timer')
+@rate_limited('timer')
 def handle_start_timer(data):
     room_id = str(data.get('room_id'))
     user_id = session.get('user_id')
@@ -515,6 +915,7 @@ def handle_start_timer(data):
     emit('update_studying_members', {'members': get_studying_members(room_id)}, room=room_id, broadcast=True)
 
 @socketio.on('pause_timer')
+@rate_limited('timer')
 def handle_pause_timer(data):
     room_id = str(data.get('room_id'))
     user_id = session.get('user_id')
@@ -534,8 +935,7 @@ def handle_stop_timer(data):
     user_id = session.get('user_id')
     timer = Timers.query.filter_by(user_id=user_id, room_id=room_id, end_time=None).first()
     if timer:
-        timer.end_time = datetime.utcnow()
-        timer.duration = (timer.end_time - timer.start_time).seconds
+        close_timer(timer)
         db.session.commit()
     if room_id in active_timers and user_id in active_timers[room_id]:
         del active_timers[room_id][user_id]
@@ -548,8 +948,7 @@ def handle_reset_timer(data):
     # End any active timer in the database
     timer = Timers.query.filter_by(user_id=user_id, room_id=room_id, end_time=None).first()
     if timer:
-        timer.end_time = datetime.utcnow()
-        timer.duration = (timer.end_time - timer.start_time).seconds
+        close_timer(timer)
         db.session.commit()
         db.session.expire_all()  # Refresh session so new queries get fresh data
     # Remove user from active_timers (if present)
@@ -580,7 +979,7 @@ socketio.start_background_task(update_active_timers)
 @app.route('/studyroom/<room_code>/leaderboard')
 def studyroom_leaderboard(room_code):
     # Fetch the study room using room_code
-    room = Studyrooms.query.filter_by(room_code=room_code).first()
+    room = get_room(room_code)
     if not room:
         flash("Study Room not found!", "danger")
         return redirect(url_for('dashboard'))
@@ -592,54 +991,36 @@ def studyroom_leaderboard(room_code):
 @app.route('/leaderboard/<room_code>')
 def leaderboard(room_code):
     # Get the study room from room_code.
-    room = Studyrooms.query.filter_by(room_code=room_code).first()
+    room = get_room(room_code)
     if not room:
         return {"error": "Room not found"}, 404
 
-    now = datetime.utcnow()
-    # Define start times for the periods:
-    start_of_day = datetime(now.year, now.month, now.day)
-    start_of_month = datetime(now.year, now.month, 1)
-    # Assuming Monday as the start of week.
-    start_of_week = now - timedelta(days=now.weekday())
-
-    # Only count timers that have an end_time (completed sessions)
-    overall_timers = (
-        db.session.query(Timers.user_id, db.func.sum(Timers.duration).label("total"))
-        .filter(Timers.room_id == room.room_id, Timers.end_time.isnot(None))
-        .group_by(Timers.user_id)
-        .all()
-    )
-    monthly_timers = (
-        db.session.query(Timers.user_id, db.func.sum(Timers.duration).label("total"))
-        .filter(
-            Timers.room_id == room.room_id,
-            Timers.end_time.isnot(None),
-            Timers.start_time >= start_of_month
-        )
-        .group_by(Timers.user_id)
-        .all()
-    )
-    weekly_timers = (
-        db.session.query(Timers.user_id, db.func.sum(Timers.duration).label("total"))
-        .filter(
-            Timers.room_id == room.room_id,
-            Timers.end_time.isnot(None),
-            Timers.start_time >= start_of_week
-        )
-        .group_by(Timers.user_id)
-        .all()
-    )
-    daily_timers = (
-        db.session.query(Timers.user_id, db.func.sum(Timers.duration).label("total"))
-        .filter(
-            Timers.room_id == room.room_id,
-            Timers.end_time.isnot(None),
-            Timers.start_time >= start_of_day
-        )
-        .group_by(Timers.user_id)
+    # Current period keys; completed timers carry the same keys in their bucket columns.
+    today, this_week, this_month = timer_buckets(datetime.utcnow())
+
+    def totals_for(bucket_column, key=None):
+        # Grouped sum served from the (room_id, <bucket>, user_id, duration) index.
+        query = db.session.query(Timers.user_id, db.func.sum(Timers.duration).label("total"))
+        query = query.filter(Timers.room_id == room.room_id)
+        if key is None:
+            # Only completed sessions have buckets assigned.
+            query = query.filter(bucket_column.isnot(None))
+        else:
+            query = query.filter(bucket_column == key)
+        return query.group_by(Timers.user_id).all()
+
+    # Timers older than every current window are compacted into TimerSummary,
+    # so only the overall board needs the cold tier.
+    compacted_timers = (
+        db.session.query(TimerSummary.user_id, db.func.sum(TimerSummary.duration))
+        .filter(TimerSummary.room_id == room.room_id)
+        .group_by(TimerSummary.user_id)
         .all()
     )
+    overall_timers = merge_totals(totals_for(Timers.month_bucket), compacted_timers)
+    monthly_timers = totals_for(Timers.month_bucket, this_month)
+    weekly_timers = totals_for(Timers.week_bucket, this_week)
+    daily_timers = totals_for(Timers.day_bucket, today)
 
     def format_leaderboard(data):
         lb = []
@@ -665,7 +1046,7 @@ def leaderboard(room_code):
 
 @app.route('/roommembers/<room_code>')
 def room_members(room_code):
-    room = Studyrooms.query.filter_by(room_code=room_code).first()
+    room = get_room(room_code)
     if not room:
         return {"error": "Room not found"}, 404
     # Query to join Roommembers and User to get member details.
@@ -715,9 +1096,14 @@ def community_blog(community):
         if not title or not content:
             flash("Title and content are required to create a post.", "error")
         else:
-            new_post = BlogPost(community=community, title=title, content=content, author_id=session['user_id'])
-            db.session.add(new_post)
-            db.session.commit()
+            with admission('blog_post', session['user_id'], community) as rejected:
+                if rejected:
+                    flash("You're posting too quickly. Please try again shortly.", "error")
+                    posts = BlogPost.query.filter_by(community=community).order_by(BlogPost.timestamp.desc()).all()
+                    return render_template('community_blog.html', community=community, posts=posts), 429, {'Retry-After': '20'}
+                new_post = BlogPost(community=community, title=title, content=content, author_id=session['user_id'])
+                db.session.add(new_post)
+                db.session.commit()
             flash("Post created successfully!", "success")
             return redirect(url_for('community_blog', community=community))
     
@@ -743,6 +1129,13 @@ def view_post(community, post_id):
     comments = Comment.query.filter_by(post_id=post.id).order_by(Comment.timestamp.asc()).all()
     return render_template('view_post.html', community=community, post=post, comments=comments)
 
+@app.route('/rate_limits')
+def rate_limits():
+    if 'user_id' not in session:
+        return redirect(url_for('signin'))
+    with rate_limit_lock:
+        return {"rejections": dict(rate_limit_rejections)}
+
 @app.route('/studygoals')
 def studygoals():
     return render_template('studygoals.html')
@@ -750,17 +1143,15 @@ def studygoals():
 @socketio.on('leave_room')
 def handle_leave_room(data):
     room_id = data['room_id']
-    username = data['username']
+    user_id = session.get('user_id')
 
-    # Get the user by username
-    user = User.query.filter_by(name=username).first()
-    if user:
+    if user_id:
         # Find the record of the user in Roommembers
-        room_member = Roommembers.query.filter_by(room_id=room_id, user_id=user.id).first()
+        room_member = Roommembers.query.filter_by(room_id=room_id, user_id=user_id).first()
         if room_member:
             db.session.delete(room_member)  # Delete user from Roommembers table
             db.session.commit()
-            print(f"User {username} has left the room {room_id}")
+            print(f"User {session.get('user_name')} has left the room {room_id}")
 
     # Ensure the user leaves the room
     leave_room(room_id)
@@ -769,5 +1160,307 @@ def handle_leave_room(data):
     emit('update_studying_members', {'members': get_studying_members(room_id)}, room=room_id, broadcast=True)
 
 
+
+# ---------------------------
+# Study history export / import
+# ---------------------------
+# Tables that can be dumped and loaded, keyed by the name used in URLs and commands.
+HISTORY_TABLES = {
+    'timers': Timers,
+    'messages': ChatMessage,
+    'timer_summaries': TimerSummary,
+    'archived_messages': ArchivedChatMessage,
+}
+EXPORT_BATCH_SIZE = 1000
+
+def history_columns(model):
+    return [column.name for column in model.__table__.columns]
+
+def iter_history_rows(model, user_id=None, room_id=None, batch_size=EXPORT_BATCH_SIZE):
+    # stream_results asks the driver for a server-side cursor (SSCursor on PyMySQL),
+    # so only one batch of rows is held in memory at a time.
+    table = model.__table__
+    stmt = db.select(table).order_by(*table.primary_key.columns)
+    if user_id is not None:
+        stmt = stmt.where(table.c.user_id == user_id)
+    if room_id is not None:
+        stmt = stmt.where(table.c.room_id == room_id)
+    if model is Timers:
+        # Open sessions belong to the live timer state, not to history.
+        stmt = stmt.where(table.c.end_time.isnot(None))
+    stmt = stmt.execution_options(stream_results=True, yield_per=batch_size)
+    for row in db.session.execute(stmt):
+        yield row._mapping
+
+def encode_history_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+HISTORY_CHUNK_SIZE = 64 * 1024
+
+def iter_history_lines(rows, columns, fmt):
+    # Yields encoded text in chunks of roughly HISTORY_CHUNK_SIZE characters
+    # (with the header first for CSV), so streams are not written row by row.
+    buffer = io.StringIO()
+    if fmt == 'csv':
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+    for row in rows:
+        if fmt == 'csv':
+            writer.writerow(['' if row[name] is None else encode_history_value(row[name]) for name in columns])
+        else:
+            buffer.write(json.dumps({name: encode_history_value(row[name]) for name in columns}) + '\n')
+        if buffer.tell() >= HISTORY_CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def gzip_chunks(chunks):
+    # wbits=31 writes a gzip header/trailer, matching what gzip.open() produces.
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+def decode_history_value(column, value):
+    if value is None or (value == '' and column.nullable):
+        return None
+    python_type = column.type.python_type
+    if python_type is datetime:
+        return datetime.fromisoformat(value)
+    if python_type is int:
+        return int(value)
+    return value
+
+def read_history_rows(stream, model, fmt, keep_ids=False):
+    columns = model.__table__.columns
+    primary_keys = {column.name for column in model.__table__.primary_key.columns}
+    records = csv.DictReader(stream) if fmt == 'csv' else (json.loads(line) for line in stream if line.strip())
+    for record in records:
+        row = {}
+        for name, value in record.items():
+            if name not in columns or (name in primary_keys and not keep_ids):
+                continue
+            row[name] = decode_history_value(columns[name], value)
+        if model is Timers:
+            if row.get('end_time') is None:
+                # Skip open sessions; they would clash with the importing user's live timer.
+                continue
+            if not (row.get('day_bucket') and row.get('week_bucket') and row.get('month_bucket')):
+                # Files from before the bucket columns existed; leaderboards ignore rows without them.
+                row['day_bucket'], row['week_bucket'], row['month_bucket'] = timer_buckets(row['start_time'])
+        yield row
+
+def import_history_rows(model, rows, batch_size=EXPORT_BATCH_SIZE):
+    # A list of parameter dicts makes this an executemany; PyMySQL rewrites an
+    # executemany INSERT into a single multi-row INSERT ... VALUES (...), (...).
+    insert = db.insert(model.__table__)
+    batch = []
+    total = 0
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            db.session.execute(insert, batch)
+            db.session.commit()
+            total += len(batch)
+            batch = []
+    if batch:
+        db.session.execute(insert, batch)
+        db.session.commit()
+        total += len(batch)
+    return total
+
+def history_format(path, fmt):
+    if fmt:
+        return fmt
+    name = path[:-3] if path.endswith('.gz') else path
+    return 'csv' if name.endswith('.csv') else 'ndjson'
+
+def open_history_file(path, mode):
+    if path == '-':
+        return click.open_file(path, mode, encoding='utf-8')
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8', newline='')
+    return open(path, mode, encoding='utf-8', newline='')
+
+@app.route('/export/<kind>')
+def export_history(kind):
+    if 'user_id' not in session:
+        return redirect(url_for('signin'))
+
+    model = HISTORY_TABLES.get(kind)
+    if model is None:
+        return {"error": "Unknown export type"}, 404
+
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in ('ndjson', 'csv'):
+        return {"error": "Format must be ndjson or csv"}, 400
+
+    # Users may export their own history, or a whole room they own.
+    user_id = session['user_id']
+    room_code = request.args.get('room_code')
+    room_id = None
+    if room_code:
+        room = get_room(room_code)
+        if not room:
+            return {"error": "Room not found"}, 404
+        if room.owner_id != user_id:
+            return {"error": "Only the room owner can export a room"}, 403
+        room_id = room.room_id
+        user_id = None
+
+    columns = history_columns(model)
+    chunks = iter_history_lines(iter_history_rows(model, user_id=user_id, room_id=room_id), columns, fmt)
+    filename = f"{kind}.{fmt}"
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    if request.args.get('gzip') == '1':
+        chunks = gzip_chunks(chunks)
+        filename += '.gz'
+        mimetype = 'application/gzip'
+
+    return Response(
+        stream_with_context(chunks),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+@app.cli.command('export-history')
+@click.argument('kind', type=click.Choice(list(HISTORY_TABLES)))
+@click.option('--user-id', type=int, help='Only rows belonging to this user.')
+@click.option('--room-id', type=int, help='Only rows belonging to this room.')
+@click.option('--format', 'fmt', type=click.Choice(['ndjson', 'csv']), help='Defaults from the output file extension.')
+@click.option('--output', '-o', default='-', show_default=True, help='File to write; a .gz suffix compresses it.')
+@click.option('--batch-size', default=EXPORT_BATCH_SIZE, show_default=True, help='Rows fetched per round trip.')
+def export_history_command(kind, user_id, room_id, fmt, output, batch_size):
+    """Stream rows of one of the history tables to NDJSON or CSV."""
+    model = HISTORY_TABLES[kind]
+    fmt = history_format(output, fmt)
+    rows = iter_history_rows(model, user_id=user_id, room_id=room_id, batch_size=batch_size)
+    with open_history_file(output, 'w') as out:
+        for chunk in iter_history_lines(rows, history_columns(model), fmt):
+            out.write(chunk)
+
+@app.cli.command('import-history')
+@click.argument('kind', type=click.Choice(list(HISTORY_TABLES)))
+@click.argument('path')
+@click.option('--format', 'fmt', type=click.Choice(['ndjson', 'csv']), help='Defaults from the input file extension.')
+@click.option('--batch-size', default=EXPORT_BATCH_SIZE, show_default=True, help='Rows per multi-row INSERT.')
+@click.option('--keep-ids', is_flag=True, help='Insert the exported primary keys instead of assigning new ones.')
+def import_history_command(kind, path, fmt, batch_size, keep_ids):
+    """Load an export-history file back into one of the history tables."""
+    model = HISTORY_TABLES[kind]
+    with open_history_file(path, 'r') as stream:
+        rows = read_history_rows(stream, model, history_format(path, fmt), keep_ids=keep_ids)
+        total = import_history_rows(model, rows, batch_size=batch_size)
+    click.echo(f"Imported {total} {kind} rows")
+
+# ---------------------------
+# Maintenance commands
+# ---------------------------
+@app.cli.command('backfill-timer-buckets')
+@click.option('--batch-size', default=1000, show_default=True, help='Timers updated per commit.')
+def backfill_timer_buckets(batch_size):
+    """Fill the Timers bucket columns for completed timers that predate them."""
+    # Walk completed timers in primary key order, one batch per commit.
+    last_id = 0
+    updated = 0
+    while True:
+        batch = (
+            Timers.query
+            .filter(Timers.timer_id > last_id, Timers.end_time.isnot(None), Timers.day_bucket.is_(None))
+            .order_by(Timers.timer_id)
+            .limit(batch_size)
+            .all()
+        )
+        if not batch:
+            break
+        for timer in batch:
+            timer.day_bucket, timer.week_bucket, timer.month_bucket = timer_buckets(timer.start_time)
+        db.session.commit()
+        last_id = batch[-1].timer_id
+        updated += len(batch)
+        click.echo(f"Backfilled {updated} timers")
+    click.echo(f"Done: {updated} timers backfilled")
+
+@app.cli.command('compact-history')
+@click.option('--chat-days', type=int, help='Archive messages older than this; defaults to CHAT_RETENTION_DAYS.')
+@click.option('--batch-size', default=1000, show_default=True, help='Rows moved per commit.')
+def compact_history(chat_days, batch_size):
+    """Move old chat messages to the archive and roll old timers into daily summaries."""
+    if chat_days is None:
+        chat_days = app.config['CHAT_RETENTION_DAYS']
+    now = datetime.utcnow()
+
+    # Chat: copy each batch into ArchivedChatMessage (keeping ids), then delete it.
+    chat_cutoff = now - timedelta(days=chat_days)
+    archived = 0
+    while True:
+        batch = (
+            ChatMessage.query
+            .filter(ChatMessage.timestamp < chat_cutoff)
+            .order_by(ChatMessage.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not batch:
+            break
+        db.session.execute(db.insert(ArchivedChatMessage.__table__), [{
+            'message_id': msg.id,
+            'room_id': msg.room_id,
+            'user_id': msg.user_id,
+            'message': msg.message,
+            'timestamp': msg.timestamp
+        } for msg in batch])
+        ChatMessage.query.filter(ChatMessage.id.in_([msg.id for msg in batch])).delete(synchronize_session=False)
+        db.session.commit()
+        archived += len(batch)
+    click.echo(f"Archived {archived} chat messages older than {chat_cutoff:%Y-%m-%d}")
+
+    # Timers: fold completed sessions that no current leaderboard window covers
+    # into their (user, room, day) summary row, then delete them.
+    timer_cutoff = timer_compaction_cutoff(now)
+    compacted = 0
+    while True:
+        batch = (
+            Timers.query
+            .filter(Timers.start_time < timer_cutoff, Timers.day_bucket.isnot(None))
+            .order_by(Timers.timer_id)
+            .limit(batch_size)
+            .all()
+        )
+        if not batch:
+            break
+        summaries = {}
+        for timer in batch:
+            key = (timer.user_id, timer.room_id, timer.day_bucket)
+            summary = summaries.get(key)
+            if summary is None:
+                summary = TimerSummary.query.filter_by(
+                    user_id=timer.user_id, room_id=timer.room_id, day_bucket=timer.day_bucket
+                ).first()
+                if summary is None:
+                    summary = TimerSummary(
+                        user_id=timer.user_id,
+                        room_id=timer.room_id,
+                        day_bucket=timer.day_bucket,
+                        week_bucket=timer.week_bucket,
+                        month_bucket=timer.month_bucket,
+                        duration=0,
+                        session_count=0
+                    )
+                    db.session.add(summary)
+                summaries[key] = summary
+            summary.duration += timer.duration
+            summary.session_count += 1
+            db.session.delete(timer)
+        db.session.commit()
+        compacted += len(batch)
+    click.echo(f"Compacted {compacted} timers started before {timer_cutoff:%Y-%m-%d}")
+
+
 if __name__ == '__main__':
     socketio.run(app, debug=True)
\ No newline at end of file